@@ -1,14 +1,282 @@
 import datetime
 import dateutil.parser
+import abc
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import json
+import operator
+import struct
+import threading
+import time
 
-class DatabaseConnection:
+try:
+    import orjson
+    ORJSON_INSTALLED = True
+except ImportError:
+    ORJSON_INSTALLED = False
+
+_UTC = datetime.timezone.utc
+_DATETIME = datetime.datetime
+_FROMISOFORMAT = datetime.datetime.fromisoformat
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo = _UTC)
+_MICROSECOND = datetime.timedelta(microseconds = 1)
+
+# Convert a native Python datetime or a parsable string to a timezone-aware
+# native Python datetime in UTC (timezone-naive input is assumed to be UTC)
+def _normalize_utc(timestamp):
+    if type(timestamp) is _DATETIME and timestamp.tzinfo is _UTC:
+        return timestamp
+    if isinstance(timestamp, str):
+        try:
+            if timestamp.endswith('Z'):
+                datetime_parsed = _FROMISOFORMAT(timestamp[:-1])
+                if datetime_parsed.tzinfo is not None:
+                    raise ValueError('Timestamp contains both a UTC offset and Z suffix')
+                timestamp = datetime_parsed.replace(tzinfo = _UTC)
+            else:
+                timestamp = _FROMISOFORMAT(timestamp)
+        except ValueError:
+            timestamp = dateutil.parser.parse(timestamp)
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo = _UTC)
+    else:
+        return timestamp.astimezone(tz = _UTC)
+
+# Convert a list of timestamps to UTC datetimes in a single pass
+def _normalize_utc_list(timestamps):
+    return [_normalize_utc(timestamp) for timestamp in timestamps]
+
+# Approximate size of each packed blob (many small datapoints in one stored
+# row/object are much cheaper to write than many small rows/objects)
+PACK_TARGET_BYTES = 10000
+
+_PACK_LENGTH = struct.Struct('>I')
+
+def pack_datapoints(
+    datapoints,
+    target_bytes = PACK_TARGET_BYTES
+):
+    """
+    Pack object time series datapoints into blobs for backends which store batches.
+
+    Datapoints are serialized to JSON with _dumps() and concatenated, each
+    prefixed by a 4-byte length. Datetimes are written as ISO 8601 strings
+    (timezone-naive datetimes are assumed to be UTC); UTC is written as 'Z' if
+    orjson is installed and as '+00:00' otherwise. unpack_datapoints() reads
+    either form. A new blob is started whenever adding the next datapoint
+    would make the current one larger than target_bytes, so a datapoint which
+    is larger than target_bytes is packed in a blob of its own. For each blob,
+    yields a tuple of the earliest timestamp, the latest timestamp, the number
+    of datapoints, and the blob itself.
+
+    Parameters:
+        datapoints (list of dict): Datapoints, each containing a 'timestamp' element
+        target_bytes (int): Approximate maximum size of each blob (default is PACK_TARGET_BYTES)
+
+    Returns:
+        (generator of tuple): Earliest timestamp, latest timestamp, number of datapoints, and blob
+    """
+    pack_length = _PACK_LENGTH.pack
+    length_size = _PACK_LENGTH.size
+    chunks = []
+    timestamps = []
+    num_bytes = 0
+    for datapoint in datapoints:
+        payload = _dumps(datapoint)
+        if chunks and num_bytes + length_size + len(payload) > target_bytes:
+            yield min(timestamps), max(timestamps), len(timestamps), b''.join(chunks)
+            chunks = []
+            timestamps = []
+            num_bytes = 0
+        chunks.append(pack_length(len(payload)))
+        chunks.append(payload)
+        timestamps.append(datapoint['timestamp'])
+        num_bytes += length_size + len(payload)
+    if chunks:
+        yield min(timestamps), max(timestamps), len(timestamps), b''.join(chunks)
+
+def unpack_datapoints(blob):
+    """
+    Unpack object time series datapoints from a blob created by pack_datapoints().
+
+    Datapoints are decoded one at a time. Timestamps are returned as
+    timezone-aware native Python datetimes in UTC.
+
+    Parameters:
+        blob (bytes): Blob created by pack_datapoints()
+
+    Returns:
+        (generator of dict): Datapoints contained in the blob
+    """
+    unpack_length = _PACK_LENGTH.unpack_from
+    length_size = _PACK_LENGTH.size
+    blob_size = len(blob)
+    offset = 0
+    while offset < blob_size:
+        (length,) = unpack_length(blob, offset)
+        offset += length_size
+        datapoint = _loads(blob[offset:offset + length])
+        offset += length
+        if 'timestamp' in datapoint:
+            datapoint['timestamp'] = _normalize_utc(datapoint['timestamp'])
+        yield datapoint
+
+# JSON serialization used by this package and available to derived classes.
+# _dumps() returns bytes and serializes datetimes as ISO strings (naive
+# datetimes are assumed to be UTC). Uses orjson if it is installed.
+if ORJSON_INSTALLED:
+    _ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+    def _dumps(value):
+        return orjson.dumps(value, option = _ORJSON_OPTIONS)
+
+    _loads = orjson.loads
+else:
+    def _dumps(value):
+        return json.dumps(value, default = _json_default).encode()
+
+    _loads = json.loads
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo = _UTC)
+        return value.isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(value).__name__))
+
+class DatabaseConnection(abc.ABC):
     """
     Class to define a simple, generic database interface that can be adapted to
     different use cases and implementations.
 
-    All methods must be implemented by derived classes.
+    Derived classes must implement the abstract internal methods which
+    communicate with the database; they cannot be instantiated otherwise.
+    Derived classes which serialize data to or from JSON should use the
+    module-level _dumps() and _loads() functions, which use orjson if it is
+    installed and fall back to the standard json module otherwise.
     """
 
+    __slots__ = (
+        'time_series_database',
+        'object_database',
+        'batch_size',
+        'flush_interval',
+        'background_flush',
+        'pool_size',
+        '_write_buffer',
+        '_last_flush_time',
+        '_lock',
+        '_flush_thread',
+        '_flush_error',
+        '_stop_flushing',
+        '_executor'
+    )
+
+    # Derived classes whose fetch methods always return data in time order
+    # should set this to True so that DataQueue can skip sorting
+    _fetches_in_time_order = False
+
+    def __init__(
+        self,
+        time_series_database = True,
+        object_database = True,
+        batch_size = 1000,
+        flush_interval = 1.0,
+        background_flush = False,
+        pool_size = 1
+    ):
+        """
+        Constructor for DatabaseConnection.
+
+        Should be called by the constructors of derived classes.
+
+        Datapoints written via the buffer methods (e.g.,
+        buffer_datapoint_object_time_series()) are held in memory and written
+        to the database in batches of up to batch_size datapoints. The buffer
+        is flushed whenever it reaches batch_size datapoints, whenever
+        flush_interval seconds have elapsed since the last flush, whenever data
+        is fetched or deleted, and when flush() or close() is called. If
+        background_flush is True, a background thread (started by the first
+        buffer call) also flushes the buffer every flush_interval seconds, so
+        datapoints buffered by any number of threads are written in combined
+        batches without waiting for the next buffer call. The thread is stopped
+        by close(). If a write made by the background thread raises an
+        exception, the exception is raised by the next flush in a calling
+        thread (e.g., when data is fetched or close() is called).
+
+        Writes, fetches, and deletes hold a lock on the connection for their
+        whole duration, so buffered datapoints are never written to the
+        database while it is being read or rewritten. Iterators returned by
+        iter_data_object_time_series() hold the lock until they are exhausted
+        or closed.
+
+        The async methods (e.g., afetch_data_object_time_series()) run the
+        corresponding synchronous methods on a pool of pool_size worker threads
+        owned by the connection, so they do not block the event loop. The
+        default of one worker serializes operations; derived classes whose
+        operations are thread-safe (e.g., those backed by a database connection
+        pool) can allow more.
+
+        Parameters:
+            time_series_database (bool): Boolean indicating whether database is a time series database (default is True)
+            object_database (bool): Boolean indicating whether database is an object database (default is True)
+            batch_size (int): Maximum number of buffered datapoints written in a single batch (default is 1000)
+            flush_interval (float): Maximum time in seconds between buffer flushes (default is 1.0)
+            background_flush (bool): Boolean indicating whether to flush the buffer from a background thread (default is False)
+            pool_size (int): Number of worker threads used by the async methods (default is 1)
+        """
+        if not time_series_database and not object_database:
+            raise ValueError('Database must be a time series database, an object database, or an object time series database')
+        if batch_size < 1:
+            raise ValueError('Batch size must be at least 1')
+        if flush_interval <= 0:
+            raise ValueError('Flush interval must be positive')
+        if pool_size < 1:
+            raise ValueError('Pool size must be at least 1')
+        self.time_series_database = time_series_database
+        self.object_database = object_database
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.background_flush = background_flush
+        self._write_buffer = collections.deque()
+        self._last_flush_time = time.monotonic()
+        self._lock = threading.RLock()
+        self._flush_thread = None
+        self._flush_error = None
+        self._stop_flushing = threading.Event()
+        self.pool_size = pool_size
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Flush any buffered datapoints and release resources held by the connection.
+        """
+        if not self._buffer_initialized():
+            return
+        with self._lock:
+            self._stop_flushing.set()
+            flush_thread = self._flush_thread
+            self._flush_thread = None
+        if flush_thread is not None:
+            flush_thread.join()
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
     def write_datapoint_object_time_series(
         self,
         timestamp,
@@ -32,11 +300,12 @@ class DatabaseConnection:
         if not self.time_series_database or not self.object_database:
             raise ValueError('Writing datapoint by timestamp and object ID only enabled for object time series databases')
         timestamp = self._python_datetime_utc(timestamp)
-        return_value = self._write_datapoint_object_time_series(
-            timestamp,
-            object_id,
-            data
-        )
+        with self._connection_lock():
+            return_value = self._write_datapoint_object_time_series(
+                timestamp,
+                object_id,
+                data
+            )
         return return_value
 
     def write_data_object_time_series(
@@ -60,24 +329,134 @@ class DatabaseConnection:
         """
         if not self.time_series_database or not self.object_database:
             raise ValueError('Writing datapoint by timestamp and object ID only enabled for object time series databases')
-        parsed_datapoints = []
-        for datapoint in datapoints:
-            if 'timestamp' not in datapoint.keys():
-                raise ValueError('Each datapoint must contain a timestamp')
-            if 'object_id' not in datapoint.keys():
-                raise ValueError('Each datapoint must contain an object ID')
-            datapoint['timestamp'] = self._python_datetime_utc(datapoint['timestamp'])
-            parsed_datapoints.append(datapoint)
-        return_value = self._write_data_object_time_series(
-            parsed_datapoints
-        )
+        parsed_datapoints = self._parse_datapoints_object_time_series(datapoints)
+        with self._connection_lock():
+            return_value = self._write_data_object_time_series(
+                parsed_datapoints
+            )
+        return return_value
+
+    def write_data_object_time_series_many(
+        self,
+        rows
+    ):
+        """
+        Write multiple datapoints, each specified as a timestamp, an object ID, and data.
+
+        Input should be a list of (timestamp, object_id, data) tuples, i.e., the
+        arguments of write_datapoint_object_time_series() for each datapoint.
+        All datapoints are written in a single batch.
+
+        Timestamps must either be native Python datetimes or strings which are
+        parsable by dateutil.parser.parse(). If timestamp is timezone-naive,
+        timezone is assumed to be UTC.
+
+        Data must be serializable by native Python json methods.
+
+        Parameters:
+            rows (list of tuple): Timestamp, object ID, and data for each datapoint
+        """
+        if not self.time_series_database or not self.object_database:
+            raise ValueError('Writing datapoint by timestamp and object ID only enabled for object time series databases')
+        rows = list(rows)
+        timestamps = _normalize_utc_list([row[0] for row in rows])
+        datapoints = []
+        for timestamp, (_, object_id, data) in zip(timestamps, rows):
+            datapoint = {
+                'timestamp': timestamp,
+                'object_id': object_id
+            }
+            datapoint.update(data)
+            datapoints.append(datapoint)
+        with self._connection_lock():
+            return_value = self._write_data_object_time_series(
+                datapoints
+            )
         return return_value
 
+    def buffer_datapoint_object_time_series(
+        self,
+        timestamp,
+        object_id,
+        data
+    ):
+        """
+        Add a single datapoint for a given timestamp and object ID to the write buffer.
+
+        Arguments are the same as for write_datapoint_object_time_series().
+        The datapoint is written to the database the next time the buffer is
+        flushed (or immediately, if the derived class does not call the
+        DatabaseConnection constructor).
+
+        Parameters:
+            timestamp (datetime or string): Timestamp associated with data
+            object_id (string): Object ID associated with data
+            data (dict): Data to be written
+        """
+        if not self._buffer_initialized():
+            return self.write_datapoint_object_time_series(timestamp, object_id, data)
+        if not self.time_series_database or not self.object_database:
+            raise ValueError('Writing datapoint by timestamp and object ID only enabled for object time series databases')
+        datapoint = {
+            'timestamp': self._python_datetime_utc(timestamp),
+            'object_id': object_id
+        }
+        datapoint.update(data)
+        self._write_buffer.append(datapoint)
+        self._start_flush_thread()
+        self._maybe_flush()
+
+    def buffer_data_object_time_series(
+        self,
+        datapoints
+    ):
+        """
+        Add multiple datapoints with timestamps and object IDs to the write buffer.
+
+        Input is the same as for write_data_object_time_series(). The datapoints
+        are written to the database the next time the buffer is flushed (or
+        immediately, if the derived class does not call the DatabaseConnection
+        constructor).
+
+        Parameters:
+            datapoints (list of dict): Datapoints to be written
+        """
+        if not self._buffer_initialized():
+            return self.write_data_object_time_series(datapoints)
+        if not self.time_series_database or not self.object_database:
+            raise ValueError('Writing datapoint by timestamp and object ID only enabled for object time series databases')
+        parsed_datapoints = self._parse_datapoints_object_time_series(datapoints)
+        self._write_buffer.extend(parsed_datapoints)
+        self._start_flush_thread()
+        self._maybe_flush()
+
+    def flush(self):
+        """
+        Write all buffered datapoints to the database.
+
+        Datapoints are written in batches of up to batch_size datapoints. If a
+        write raises an exception, the batch which failed is removed from the
+        buffer (so that datapoints which cannot be written do not block later
+        operations) and the exception is raised. Datapoints in later batches
+        remain in the buffer. An exception raised by a write made by the
+        background thread is raised by the next call to this method (after the
+        buffer has been written).
+        """
+        if not self._buffer_initialized():
+            return
+        with self._lock:
+            self._flush_buffer()
+            if self._flush_error is not None:
+                flush_error = self._flush_error
+                self._flush_error = None
+                raise flush_error
+
     def fetch_data_object_time_series(
         self,
         start_time = None,
         end_time = None,
-        object_ids = None
+        object_ids = None,
+        bucket_size = None
     ):
         """
         Fetch data for a given timespan and set of object IDs.
@@ -91,12 +470,22 @@ class DatabaseConnection:
         to most recent data in database. If object IDs are not specified, data
         is returned for all objects.
 
+        If bucket size is specified (and start time and end time are both
+        specified), the timespan is split into consecutive buckets aligned to
+        multiples of the bucket size and data is returned bucket by bucket.
+        This is a hint for derived classes which index data by time bucket,
+        which can scan each bucket contiguously (e.g., in parallel). By
+        default, the whole timespan is fetched in a single operation and the
+        result is split into buckets, so the hint only helps derived classes
+        which override _fetch_data_object_time_series_buckets().
+
         Returns a list of dictionaries, one for each datapoint.
 
         Parameters:
             start_time (datetime or string): Beginning of timespan (default: None)
             end_time (datetime or string): End of timespan (default: None)
             object_ids (list of strings): Object IDs (default: None)
+            bucket_size (timedelta): Size of time buckets to fetch separately (default: None)
 
         Returns:
             (list of dict): All data associated with specified time span and object IDs
@@ -107,12 +496,107 @@ class DatabaseConnection:
             start_time = self._python_datetime_utc(start_time)
         if end_time is not None:
             end_time = self._python_datetime_utc(end_time)
-        data = self._fetch_data_object_time_series(
+        with self._connection_lock():
+            self.flush()
+            if bucket_size is None or start_time is None or end_time is None:
+                data = self._fetch_data_object_time_series(
+                    start_time,
+                    end_time,
+                    object_ids
+                )
+                return data
+            time_ranges = self._split_time_range(
+                start_time,
+                end_time,
+                bucket_size
+            )
+            bucket_data = self._fetch_data_object_time_series_buckets(
+                time_ranges,
+                object_ids
+            )
+        data = [datapoint for datapoints in bucket_data for datapoint in datapoints]
+        return data
+
+    def iter_data_object_time_series(
+        self,
+        start_time = None,
+        end_time = None,
+        object_ids = None
+    ):
+        """
+        Iterate over data for a given timespan and set of object IDs.
+
+        Arguments are the same as for fetch_data_object_time_series(). Rather
+        than a list, returns an iterator over the datapoints, so derived classes
+        which can stream data from the database do not need to hold the entire
+        result in memory. The connection is locked while the iterator is in
+        use, so it should be exhausted or closed promptly.
+
+        Parameters:
+            start_time (datetime or string): Beginning of timespan (default: None)
+            end_time (datetime or string): End of timespan (default: None)
+            object_ids (list of strings): Object IDs (default: None)
+
+        Returns:
+            (iterator of dict): All data associated with specified time span and object IDs
+        """
+        if not self.time_series_database or not self.object_database:
+            raise ValueError('Fetching data by time interval and/or object ID only enabled for object time series databases')
+        self.flush()
+        if start_time is not None:
+            start_time = self._python_datetime_utc(start_time)
+        if end_time is not None:
+            end_time = self._python_datetime_utc(end_time)
+        data_iterator = self._iter_data_object_time_series_locked(
             start_time,
             end_time,
             object_ids
         )
-        return data
+        return data_iterator
+
+    def fetch_data_object_time_series_columnar(
+        self,
+        start_time = None,
+        end_time = None,
+        object_ids = None,
+        fields = None
+    ):
+        """
+        Fetch data for a given timespan and set of object IDs in column format.
+
+        Arguments are the same as for fetch_data_object_time_series(), except
+        that fields may be specified to restrict the columns returned.
+
+        Returns a dictionary with one element per field. Each value is a list
+        containing that field for every datapoint (None where a datapoint does
+        not contain the field), so the result can be passed directly to (e.g.)
+        pandas.DataFrame(). If fields are not specified, all fields present in
+        the data are returned.
+
+        Parameters:
+            start_time (datetime or string): Beginning of timespan (default: None)
+            end_time (datetime or string): End of timespan (default: None)
+            object_ids (list of strings): Object IDs (default: None)
+            fields (list of strings): Fields to return (default: None)
+
+        Returns:
+            (dict of list): All data associated with specified time span and object IDs, by field
+        """
+        if not self.time_series_database or not self.object_database:
+            raise ValueError('Fetching data by time interval and/or object ID only enabled for object time series databases')
+        if start_time is not None:
+            start_time = self._python_datetime_utc(start_time)
+        if end_time is not None:
+            end_time = self._python_datetime_utc(end_time)
+        with self._connection_lock():
+            self.flush()
+            columns = self._fetch_data_object_time_series_columnar(
+                start_time,
+                end_time,
+                object_ids,
+                fields
+            )
+        return columns
 
     def delete_data_object_time_series(
         self,
@@ -144,11 +628,76 @@ class DatabaseConnection:
             raise ValueError('Object IDs must be specified for delete data operation')
         start_time = self._python_datetime_utc(start_time)
         end_time = self._python_datetime_utc(end_time)
-        self._delete_data_object_time_series(
+        with self._connection_lock():
+            self.flush()
+            self._delete_data_object_time_series(
+                start_time,
+                end_time,
+                object_ids
+            )
+
+    async def awrite_datapoint_object_time_series(
+        self,
+        timestamp,
+        object_id,
+        data
+    ):
+        """
+        Asynchronous version of write_datapoint_object_time_series().
+
+        Parameters:
+            timestamp (datetime or string): Timestamp associated with data
+            object_id (string): Object ID associated with data
+            data (dict): Data to be written
+        """
+        return_value = await self._run_in_executor(
+            self.write_datapoint_object_time_series,
+            timestamp,
+            object_id,
+            data
+        )
+        return return_value
+
+    async def awrite_data_object_time_series(
+        self,
+        datapoints
+    ):
+        """
+        Asynchronous version of write_data_object_time_series().
+
+        Parameters:
+            datapoints (list of dict): Datapoints to be written
+        """
+        return_value = await self._run_in_executor(
+            self.write_data_object_time_series,
+            datapoints
+        )
+        return return_value
+
+    async def afetch_data_object_time_series(
+        self,
+        start_time = None,
+        end_time = None,
+        object_ids = None
+    ):
+        """
+        Asynchronous version of fetch_data_object_time_series().
+
+        Parameters:
+            start_time (datetime or string): Beginning of timespan (default: None)
+            end_time (datetime or string): End of timespan (default: None)
+            object_ids (list of strings): Object IDs (default: None)
+
+        Returns:
+            (list of dict): All data associated with specified time span and object IDs
+        """
+        data = await self._run_in_executor(
+            self.fetch_data_object_time_series,
             start_time,
             end_time,
             object_ids
         )
+        return data
 
     def to_data_queue(
         self,
@@ -178,67 +727,256 @@ class DatabaseConnection:
         Returns:
             (DataQueue): Iterator which contains the requested data
         """
-        data = self.fetch_data_object_time_series(
+        data = self.iter_data_object_time_series(
             start_time,
             end_time,
             object_ids
         )
         data_queue = DataQueue(
-            data = data
+            data = data,
+            already_sorted = self._fetches_in_time_order
         )
         return data_queue
 
     def _python_datetime_utc(self, timestamp):
-        try:
-            if timestamp.tzinfo is None:
-                datetime_utc = timestamp.replace(tzinfo = datetime.timezone.utc)
-            else:
-                datetime_utc = timestamp.astimezone(tz=datetime.timezone.utc)
-        except:
-            datetime_parsed = dateutil.parser.parse(timestamp)
-            if datetime_parsed.tzinfo is None:
-                datetime_utc = datetime_parsed.replace(tzinfo = datetime.timezone.utc)
-            else:
-                datetime_utc = datetime_parsed.astimezone(tz=datetime.timezone.utc)
-        return datetime_utc
+        return _normalize_utc(timestamp)
 
+    # Check that each datapoint contains a timestamp and an object ID and
+    # convert all timestamps to UTC datetimes in a single pass
+    def _parse_datapoints_object_time_series(self, datapoints):
+        datapoints = list(datapoints)
+        for datapoint in datapoints:
+            if 'timestamp' not in datapoint:
+                raise ValueError('Each datapoint must contain a timestamp')
+            if 'object_id' not in datapoint:
+                raise ValueError('Each datapoint must contain an object ID')
+        timestamps = _normalize_utc_list([datapoint['timestamp'] for datapoint in datapoints])
+        for datapoint, timestamp in zip(datapoints, timestamps):
+            datapoint['timestamp'] = timestamp
+        return datapoints
+
+    # Split a time span into consecutive buckets aligned to multiples of the
+    # bucket size (since the Unix epoch). Buckets are returned as (start, end)
+    # pairs which include both endpoints, so each bucket ends one microsecond
+    # before the next one starts.
+    def _split_time_range(
+        self,
+        start_time,
+        end_time,
+        bucket_size
+    ):
+        if bucket_size <= datetime.timedelta(0):
+            raise ValueError('Bucket size must be positive')
+        time_ranges = []
+        bucket_start = start_time
+        while bucket_start <= end_time:
+            next_bucket_start = _EPOCH + ((bucket_start - _EPOCH) // bucket_size + 1) * bucket_size
+            bucket_end = min(next_bucket_start - _MICROSECOND, end_time)
+            time_ranges.append((bucket_start, bucket_end))
+            bucket_start = next_bucket_start
+        return time_ranges
+
+    # Derived classes written before the write buffer was added may not call
+    # the DatabaseConnection constructor, in which case datapoints are not
+    # buffered and there is nothing to flush or close
+    def _buffer_initialized(self):
+        return hasattr(self, '_write_buffer')
+
+    # Lock held for the whole of each write, fetch, and delete (derived classes
+    # which do not call the DatabaseConnection constructor have no background
+    # thread and are not locked)
+    def _connection_lock(self):
+        if not self._buffer_initialized():
+            return contextlib.nullcontext()
+        return self._lock
+
+    # Iterate over data while holding the lock, so that the background thread
+    # does not write to the database while it is being read
+    def _iter_data_object_time_series_locked(
+        self,
+        start_time,
+        end_time,
+        object_ids
+    ):
+        with self._connection_lock():
+            yield from self._iter_data_object_time_series(
+                start_time,
+                end_time,
+                object_ids
+            )
+
+    def _run_in_executor(self, function, *args):
+        if not self._buffer_initialized():
+            loop = asyncio.get_running_loop()
+            return loop.run_in_executor(None, function, *args)
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers = self.pool_size)
+        loop = asyncio.get_running_loop()
+        return loop.run_in_executor(self._executor, function, *args)
+
+    # Start the background flush thread on the first buffer call rather than
+    # in the constructor, so that a derived class constructor which raises
+    # does not leave a thread running. The thread is not restarted after
+    # close().
+    def _start_flush_thread(self):
+        if not self.background_flush or self._flush_thread is not None:
+            return
+        with self._lock:
+            if self._flush_thread is None and not self._stop_flushing.is_set():
+                self._flush_thread = threading.Thread(
+                    target = self._flush_periodically,
+                    daemon = True
+                )
+                self._flush_thread.start()
+
+    # Write all buffered datapoints in batches (the lock must be held)
+    def _flush_buffer(self):
+        while self._write_buffer:
+            num_datapoints = min(self.batch_size, len(self._write_buffer))
+            datapoints = [self._write_buffer.popleft() for _ in range(num_datapoints)]
+            self._write_data_object_time_series(datapoints)
+        self._last_flush_time = time.monotonic()
+
+    # Exceptions raised by a write are not allowed to stop the thread (the
+    # batch which failed has already been removed from the buffer). The most
+    # recent one is kept and raised by the next call to flush().
+    def _flush_periodically(self):
+        while not self._stop_flushing.wait(self.flush_interval):
+            with self._lock:
+                try:
+                    self._flush_buffer()
+                except Exception as error:
+                    self._flush_error = error
+
+    # Flush the buffer when it is full or (unless the background thread is
+    # responsible for periodic flushes) when the flush interval has elapsed
+    def _maybe_flush(self):
+        if not self._buffer_initialized():
+            return
+        if (
+            len(self._write_buffer) >= self.batch_size or
+            (self._flush_thread is None and time.monotonic() - self._last_flush_time >= self.flush_interval)
+        ):
+            self.flush()
+
+    # Specifics of communication with database must be implemented in child class
+    @abc.abstractmethod
     def _write_datapoint_object_time_series(
         self,
         timestamp,
         object_id,
         data
     ):
-        raise NotImplementedError('Specifics of communication with database must be implemented in child class')
+        pass
 
+    # Default implementation writes datapoints one at a time; derived classes
+    # should override this to write all datapoints in a single operation
     def _write_data_object_time_series(
         self,
         datapoints
     ):
-        raise NotImplementedError('Specifics of communication with database must be implemented in child class')
+        for datapoint in datapoints:
+            data = {key: value for key, value in datapoint.items() if key not in ('timestamp', 'object_id')}
+            self._write_datapoint_object_time_series(
+                datapoint['timestamp'],
+                datapoint['object_id'],
+                data
+            )
 
+    # Specifics of communication with database must be implemented in child class
+    @abc.abstractmethod
     def _fetch_data_object_time_series(
         self,
         start_time,
         end_time,
         object_ids
     ):
-        raise NotImplementedError('Specifics of communication with database must be implemented in child class')
+        pass
 
+    # Default implementation fetches the whole timespan covered by the buckets
+    # with _fetch_data_object_time_series() and splits the result into one
+    # list per bucket; derived classes which index data by time bucket should
+    # override this to scan each bucket separately (e.g., on up to pool_size
+    # threads)
+    def _fetch_data_object_time_series_buckets(
+        self,
+        time_ranges,
+        object_ids
+    ):
+        if not time_ranges:
+            return []
+        data = self._fetch_data_object_time_series(
+            time_ranges[0][0],
+            time_ranges[-1][1],
+            object_ids
+        )
+        bucket_starts = [time_range[0] for time_range in time_ranges]
+        bucket_data = [[] for _ in time_ranges]
+        for datapoint in data:
+            bucket_data[bisect.bisect_right(bucket_starts, datapoint['timestamp']) - 1].append(datapoint)
+        return bucket_data
+
+    # Default implementation iterates over the output of
+    # _fetch_data_object_time_series(); derived classes which can stream data
+    # from the database should override this
+    def _iter_data_object_time_series(
+        self,
+        start_time,
+        end_time,
+        object_ids
+    ):
+        data = self._fetch_data_object_time_series(
+            start_time,
+            end_time,
+            object_ids
+        )
+        return iter(data)
+
+    # Default implementation converts the output of
+    # _fetch_data_object_time_series() to column format; derived classes which
+    # store data by column should override this
+    def _fetch_data_object_time_series_columnar(
+        self,
+        start_time,
+        end_time,
+        object_ids,
+        fields
+    ):
+        data = self._fetch_data_object_time_series(
+            start_time,
+            end_time,
+            object_ids
+        )
+        if fields is None:
+            fields = list(dict.fromkeys(key for datapoint in data for key in datapoint))
+        columns = {field: [datapoint.get(field) for datapoint in data] for field in fields}
+        return columns
+
+    # Specifics of communication with database must be implemented in child class
+    @abc.abstractmethod
     def _delete_data_object_time_series(
         self,
         start_time,
         end_time,
         object_ids
     ):
-        raise NotImplementedError('Specifics of communication with database must be implemented in child class')
+        pass
 
 class DataQueue:
     """
     Class to define an iterable which returns datapoints in time order.
     """
+
+    __slots__ = (
+        'data',
+        'num_datapoints',
+        'next_data_pointer'
+    )
+
     def __init__(
         self,
-        data
+        data,
+        already_sorted = False
         ):
         """
         Constructor for DataQueue.
@@ -246,12 +984,20 @@ class DataQueue:
         Data must be in the format returned by
         DatabaseConnection.fetch_data_object_time_series() (i.e., simple list of
         dicts containing the datapoints; every datapoint must contain a
-        'timestamp' field in timezone-aware native Python datetime format).
+        'timestamp' field in timezone-aware native Python datetime format). Any
+        other iterable of such dicts (e.g., the iterator returned by
+        DatabaseConnection.iter_data_object_time_series()) is also accepted. A
+        list is sorted in place unless already_sorted is True, in which case
+        the data must already be in time order.
 
         Parameters:
             data (list of dict): Data to populate the queue
+            already_sorted (bool): Boolean indicating whether data is already in time order (default is False)
         """
-        data.sort(key = lambda datapoint: datapoint['timestamp'])
+        if not isinstance(data, list):
+            data = list(data)
+        if not already_sorted:
+            data.sort(key = operator.itemgetter('timestamp'))
         self.data = data
         self.num_datapoints = len(data)
         self.next_data_pointer = 0
@@ -274,3 +1020,18 @@ class DataQueue:
             datapoint = self.data[self.next_data_pointer]
             self.next_data_pointer += 1
             return datapoint
+
+    def iter_timestamps(self):
+        """
+        Iterate over the timestamps of the remaining datapoints in time order.
+
+        Advances the queue in the same way as fetching datapoints, but yields
+        only the timestamp of each datapoint.
+
+        Returns:
+            (generator of datetime): Timestamps of the remaining datapoints
+        """
+        while self.next_data_pointer < self.num_datapoints:
+            timestamp = self.data[self.next_data_pointer]['timestamp']
+            self.next_data_pointer += 1
+            yield timestamp
@@ -1,8 +1,9 @@
-from . import DatabaseConnection
-import dateutil.parser
+from . import DatabaseConnection, _normalize_utc
+import datetime
 import os
+import sys
 import csv
-import time
+import functools
 
 try:
     import pandas as pd
@@ -10,11 +11,36 @@ try:
 except:
     PANDAS_INSTALLED = False
 
+# Parse a timestamp string from the CSV file. Rows often share timestamps
+# (e.g., one row per object for each measurement time) and datetimes are
+# immutable, so recently parsed timestamps are cached.
+@functools.lru_cache(maxsize = 4096)
+def _parse_timestamp(string):
+    return _normalize_utc(string)
+
+# Buffer size used for all reads and writes of CSV files
+_BUFFER_SIZE = 1 << 20
+
+# Number of rows read at a time when reading CSV files with pandas
+_PANDAS_CHUNK_SIZE = 100000
+
 class DatabaseConnectionCSV(DatabaseConnection):
     """
     Class to define a DatabaseConnection to a CSV file
     """
 
+    __slots__ = (
+        'path',
+        'use_pandas',
+        'convert_to_string_functions',
+        'convert_from_string_functions',
+        'field_names',
+        '_to_string_functions',
+        '_from_string_functions',
+        '_append_fh',
+        '_append_writer'
+    )
+
     def __init__(
         self,
         path,
@@ -22,7 +48,11 @@ class DatabaseConnectionCSV(DatabaseConnection):
         object_database = True,
         data_field_names = None,
         convert_to_string_functions = {},
-        convert_from_string_functions = {}
+        convert_from_string_functions = {},
+        use_pandas = True,
+        batch_size = 1000,
+        flush_interval = 1.0,
+        background_flush = False
     ):
         """
         Constructor for DatabaseConnectionCSV.
@@ -53,7 +83,17 @@ class DatabaseConnectionCSV(DatabaseConnection):
         standard str() function when writing to the CSV file and it will be left
         as a string when reading from the CSV file. The exception is the
         'timestamp' field, which is converted to a string via the isoformat()
-        method and converted from a string via dateutil.parser.parse().
+        method and converted from a string to a UTC datetime via
+        datetime.fromisoformat() (falling back to dateutil.parser.parse() for
+        strings which are not in ISO format).
+
+        If use_pandas is True and pandas is installed, pandas is used to read
+        the CSV file (in chunks) when fetching and deleting data. Otherwise,
+        the file is read row by row with the native csv module.
+
+        Written rows are held in a buffered file handle which is kept open
+        between writes. They are flushed to the file before it is read and when
+        close() is called.
 
         Parameters:
             path (string): Path to CSV file
@@ -62,31 +102,41 @@ class DatabaseConnectionCSV(DatabaseConnection):
             data_field_names (list of string): Fields (other than 'timestamp' and 'object_id') to incude in CSV file
             convert_to_string_functions (dict of functions): Functions used to convert from values to strings
             convert_from_string_functions (dict of functions): Functions used to convert from strings to values
+            use_pandas (bool): Boolean indicating whether to use pandas (if installed) to read CSV file (default is True)
+            batch_size (int): Maximum number of buffered datapoints written in a single batch (default is 1000)
+            flush_interval (float): Maximum time in seconds between buffer flushes (default is 1.0)
+            background_flush (bool): Boolean indicating whether to flush the buffer from a background thread (default is False)
         """
-        if not time_series_database and not object_database:
-            raise ValueError('Database must be a time series database, an object database, or an object time series database')
+        self._append_fh = None
+        self._append_writer = None
+        super().__init__(
+            time_series_database = time_series_database,
+            object_database = object_database,
+            batch_size = batch_size,
+            flush_interval = flush_interval,
+            background_flush = background_flush
+        )
         if data_field_names is not None and 'timestamp' in data_field_names:
             raise ValueError('Field name \'timestamp\' is reserved')
         if data_field_names is not None and 'object_id' in data_field_names:
             raise ValueError('Field name \'object_id\' is reserved')
         self.path = path
-        self.time_series_database = time_series_database
-        self.object_database = object_database
+        self.use_pandas = use_pandas and PANDAS_INSTALLED
         self.convert_to_string_functions = convert_to_string_functions
         self.convert_from_string_functions = convert_from_string_functions
-        if PANDAS_INSTALLED:
-            self._fetch_data_object_time_series = self._fetch_data_object_time_series_pandas
-            self._delete_data_object_time_series = self._delete_data_object_time_series_pandas
-        else:
-            self._fetch_data_object_time_series = self._fetch_data_object_time_series_python_native
-            self._delete_data_object_time_series = self._delete_data_object_time_series_python_native
         self.field_names = []
         if time_series_database:
             self.field_names.append('timestamp')
         if object_database:
             self.field_names.append('object_id')
         if data_field_names is not None:
-            self.field_names.extend(data_field_names)
+            # Intern field names so that per-row dict lookups by field name can
+            # match keys by identity
+            self.field_names.extend(sys.intern(field_name) for field_name in data_field_names)
+        # Look up the function used to convert each field to a string once
+        # rather than for every value written
+        self._to_string_functions = [self._to_string_function(field_name) for field_name in self.field_names]
+        self._from_string_functions = [self._from_string_function(field_name) for field_name in self.field_names]
         # Check if file already exists
         if os.path.exists(self.path):
             # If file already exists, check to see that header row of file matches
@@ -117,10 +167,7 @@ class DatabaseConnectionCSV(DatabaseConnection):
             'object_id': object_id
         }
         value_dict.update(data)
-        string_dict = {field_name: self._convert_to_string(field_name, value_dict.get(field_name)) for field_name in self.field_names}
-        with open(self.path, mode = 'a', newline = '') as fh:
-            writer = csv.DictWriter(fh, self.field_names)
-            writer.writerow(string_dict)
+        self._get_append_writer().writerow(self._to_string_row(value_dict))
 
     # Internal method for writing multiple datapoints of object time series data
     # (CSV-database-specific)
@@ -128,11 +175,8 @@ class DatabaseConnectionCSV(DatabaseConnection):
         self,
         datapoints
     ):
-        with open(self.path, mode = 'a', newline = '') as fh:
-            writer = csv.DictWriter(fh, self.field_names)
-            for datapoint in datapoints:
-                string_dict = {field_name: self._convert_to_string(field_name, datapoint.get(field_name)) for field_name in self.field_names}
-                writer.writerow(string_dict)
+        string_rows = [self._to_string_row(datapoint) for datapoint in datapoints]
+        self._get_append_writer().writerows(string_rows)
 
     # Native python version of internal method for fetching object time series
     # data (CSV-database-specific)
@@ -142,20 +186,56 @@ class DatabaseConnectionCSV(DatabaseConnection):
         end_time,
         object_ids
     ):
-        fetched_data = []
-        with open(self.path, mode = 'r', newline = '') as fh:
-            reader = csv.DictReader(fh)
-            string_dicts = list(reader)
-            for string_dict in string_dicts:
-                value_dict = {field_name: self._convert_from_string(field_name, string_dict.get(field_name)) for field_name in self.field_names}
-                if start_time is not None and value_dict['timestamp'] < start_time:
+        fetched_data = list(self._iter_data_object_time_series_python_native(
+            start_time,
+            end_time,
+            object_ids
+        ))
+        return fetched_data
+
+    # Native python version of internal method for iterating over object time
+    # series data (CSV-database-specific). Reads the file one row at a time.
+    def _iter_data_object_time_series_python_native(
+        self,
+        start_time,
+        end_time,
+        object_ids
+    ):
+        self._flush_append_file()
+        field_names = self.field_names
+        from_string_functions = self._from_string_functions
+        num_fields = len(field_names)
+        timestamp_index = field_names.index('timestamp')
+        object_id_index = field_names.index('object_id')
+        parse_timestamp = from_string_functions[timestamp_index]
+        parse_object_id = from_string_functions[object_id_index]
+        if object_ids is not None:
+            object_ids = frozenset(object_ids)
+        with open(self.path, mode = 'r', newline = '', buffering = _BUFFER_SIZE) as fh:
+            reader = csv.reader(fh)
+            next(reader, None)
+            for row in reader:
+                if not row:
                     continue
-                if end_time is not None and value_dict['timestamp'] > end_time:
+                if len(row) != num_fields:
+                    row = (row + [''] * num_fields)[:num_fields]
+                # Filter on timestamp and object ID before converting other fields
+                timestamp_string = row[timestamp_index]
+                timestamp = parse_timestamp(timestamp_string) if timestamp_string != '' else None
+                if start_time is not None and timestamp < start_time:
                     continue
-                if object_ids is not None and value_dict['object_id'] not in object_ids:
+                if end_time is not None and timestamp > end_time:
                     continue
-                fetched_data.append(value_dict)
-        return fetched_data
+                if object_ids is not None:
+                    object_id_string = row[object_id_index]
+                    object_id = parse_object_id(object_id_string) if object_id_string != '' else None
+                    if object_id not in object_ids:
+                        continue
+                value_dict = {
+                    field_name: None if string == '' else from_string_function(string)
+                    for field_name, from_string_function, string in zip(field_names, from_string_functions, row)
+                }
+                yield value_dict
 
     # Pandas version of internal method for fetching object time series data
     # (CSV-database-specific)
@@ -165,29 +245,50 @@ class DatabaseConnectionCSV(DatabaseConnection):
         end_time,
         object_ids
     ):
+        fetched_data = list(self._iter_data_object_time_series_pandas(
+            start_time,
+            end_time,
+            object_ids
+        ))
+        return fetched_data
+
+    # Pandas version of internal method for iterating over object time series
+    # data (CSV-database-specific). Reads and filters the file in chunks of
+    # _PANDAS_CHUNK_SIZE rows.
+    def _iter_data_object_time_series_pandas(
+        self,
+        start_time,
+        end_time,
+        object_ids
+    ):
+        self._flush_append_file()
+        if object_ids is not None:
+            object_ids = list(object_ids)
         converters = self.convert_from_string_functions
-        df = pd.read_csv(
+        chunks = pd.read_csv(
             self.path,
-            parse_dates = ['timestamp'],
-            infer_datetime_format = True,
             converters = converters,
-            dtype = str
+            dtype = str,
+            chunksize = _PANDAS_CHUNK_SIZE
         )
-        if len(df) == 0:
-            return []
-        if start_time is not None or end_time is not None or object_ids is not None:
-            boolean = True
-            if start_time is not None:
-                boolean = boolean & (df['timestamp'] > start_time)
-            if end_time is not None:
-                boolean = boolean & (df['timestamp'] < end_time)
-            if object_ids is not None:
-                boolean = boolean & df['object_id'].isin(object_ids)
-            df = df[boolean].reset_index(drop = True)
-        fetched_data = df.to_dict('records')
-        for i in range(len(fetched_data)):
-            fetched_data[i]['timestamp'] = fetched_data[i]['timestamp'].to_pydatetime()
-        return fetched_data
+        with chunks:
+            for df in chunks:
+                if len(df) == 0:
+                    continue
+                df['timestamp'] = self._parse_timestamps_pandas(df['timestamp'])
+                if start_time is not None or end_time is not None or object_ids is not None:
+                    boolean = True
+                    if start_time is not None:
+                        boolean = boolean & (df['timestamp'] >= start_time)
+                    if end_time is not None:
+                        boolean = boolean & (df['timestamp'] <= end_time)
+                    if object_ids is not None:
+                        boolean = boolean & df['object_id'].isin(object_ids)
+                    df = df[boolean].reset_index(drop = True)
+                fetched_data = df.to_dict('records')
+                for datapoint in fetched_data:
+                    datapoint['timestamp'] = datapoint['timestamp'].to_pydatetime()
+                    yield datapoint
 
     # Native Python version of internal method for deleting object time series
     # data (CSV-database-specific)
@@ -197,20 +298,30 @@ class DatabaseConnectionCSV(DatabaseConnection):
         end_time,
         object_ids
     ):
-        read_fh = open(self.path, mode = 'r', newline = '')
-        reader = csv.DictReader(read_fh)
-        write_fh =  open('.temp.csv', 'w', newline = '')
-        writer = csv.DictWriter(write_fh, fieldnames = self.field_names)
-        writer.writeheader()
-        for string_dict in reader:
-            value_dict = {field_name: self._convert_from_string(field_name, string_dict.get(field_name)) for field_name in self.field_names}
-            if value_dict['timestamp'] > start_time and value_dict['timestamp'] < end_time and value_dict['object_id'] in object_ids:
-                continue
-            writer.writerow(string_dict)
-        write_fh.close()
-        read_fh.close()
-        time.sleep(1)
-        os.replace('.temp.csv', self.path)
+        self._close_append_file()
+        timestamp_index = self.field_names.index('timestamp')
+        object_id_index = self.field_names.index('object_id')
+        parse_timestamp = self._from_string_functions[timestamp_index]
+        parse_object_id = self._from_string_functions[object_id_index]
+        object_ids = frozenset(object_ids)
+        temp_path = '{}.temp'.format(self.path)
+        with open(self.path, mode = 'r', newline = '', buffering = _BUFFER_SIZE) as read_fh, \
+                open(temp_path, mode = 'w', newline = '', buffering = _BUFFER_SIZE) as write_fh:
+            reader = csv.reader(read_fh)
+            writer = csv.writer(write_fh)
+            writer.writerow(self.field_names)
+            next(reader, None)
+            # Only the timestamp and object ID of each row are converted; rows
+            # which are kept are copied to the new file unchanged
+            kept_rows = (
+                row for row in reader
+                if row and not (
+                    start_time < parse_timestamp(row[timestamp_index]) < end_time and
+                    parse_object_id(row[object_id_index]) in object_ids
+                )
+            )
+            writer.writerows(kept_rows)
+        os.replace(temp_path, self.path)
 
     # Pandas version of internal method for deleting object time series data
     # (CSV-database-specific)
@@ -220,16 +331,16 @@ class DatabaseConnectionCSV(DatabaseConnection):
         end_time,
         object_ids
     ):
+        self._close_append_file()
         converters = self.convert_from_string_functions
         df = pd.read_csv(
             self.path,
-            parse_dates = ['timestamp'],
-            infer_datetime_format = True,
             converters = converters,
             dtype = str
         )
         if len(df) == 0:
             return
+        df['timestamp'] = self._parse_timestamps_pandas(df['timestamp'])
         boolean = False
         boolean = boolean | (df['timestamp'] <= start_time)
         boolean = boolean | (df['timestamp'] >= end_time)
@@ -237,29 +348,122 @@ class DatabaseConnectionCSV(DatabaseConnection):
         df = df[boolean].reset_index(drop = True)
         for column_name in df.columns:
             if column_name == 'timestamp':
-                continue
+                df[column_name] = df[column_name].apply(self._to_string_function(column_name))
             elif column_name in self.convert_to_string_functions:
                 df[column_name] = df[column_name].apply(self.convert_to_string_functions[column_name])
             else:
                 df[column_name] = df[column_name].astype(str)
         df.to_csv(self.path, index = False)
 
+    # Parse a column of timestamp strings read by pandas to UTC datetimes. The
+    # format is specified rather than inferred (separately for each chunk) so
+    # that files containing a mix of ISO 8601 variants (e.g., 'T' or space
+    # separators and different UTC offsets) are parsed consistently.
+    def _parse_timestamps_pandas(self, timestamps):
+        if 'timestamp' in self.convert_from_string_functions:
+            return pd.to_datetime(timestamps, utc = True)
+        return pd.to_datetime(timestamps, utc = True, format = 'ISO8601')
+
+    # Internal methods for fetching and deleting object time series data
+    # (CSV-database-specific). Use pandas versions if enabled.
+    def _fetch_data_object_time_series(
+        self,
+        start_time,
+        end_time,
+        object_ids
+    ):
+        if self.use_pandas:
+            return self._fetch_data_object_time_series_pandas(start_time, end_time, object_ids)
+        else:
+            return self._fetch_data_object_time_series_python_native(start_time, end_time, object_ids)
+
+    def _iter_data_object_time_series(
+        self,
+        start_time,
+        end_time,
+        object_ids
+    ):
+        if self.use_pandas:
+            return self._iter_data_object_time_series_pandas(start_time, end_time, object_ids)
+        else:
+            return self._iter_data_object_time_series_python_native(start_time, end_time, object_ids)
+
+    def _delete_data_object_time_series(
+        self,
+        start_time,
+        end_time,
+        object_ids
+    ):
+        if self.use_pandas:
+            self._delete_data_object_time_series_pandas(start_time, end_time, object_ids)
+        else:
+            self._delete_data_object_time_series_python_native(start_time, end_time, object_ids)
+
+    def close(self):
+        """
+        Flush any buffered datapoints, write any buffered rows to the CSV file,
+        and close the file.
+        """
+        try:
+            super().close()
+        finally:
+            self._close_append_file()
+
+    # Open the CSV file for appending on first use and keep it open
+    def _get_append_writer(self):
+        if self._append_writer is None:
+            self._append_fh = open(self.path, mode = 'a', newline = '', buffering = _BUFFER_SIZE)
+            self._append_writer = csv.writer(self._append_fh)
+        return self._append_writer
+
+    # Write any buffered rows to the CSV file (before it is read)
+    def _flush_append_file(self):
+        if self._append_fh is not None:
+            self._append_fh.flush()
+
+    # Close the CSV file handle used for appending (before the file is
+    # rewritten)
+    def _close_append_file(self):
+        if self._append_fh is not None:
+            self._append_fh.close()
+            self._append_fh = None
+            self._append_writer = None
+
+    # Convert a datapoint to a list of strings in field name order
+    def _to_string_row(self, datapoint):
+        return [
+            '' if value is None else to_string_function(value)
+            for value, to_string_function in zip(map(datapoint.get, self.field_names), self._to_string_functions)
+        ]
+
+    # Function used to convert non-empty values of a field to strings
+    def _to_string_function(self, field_name):
+        if field_name in self.convert_to_string_functions:
+            return self.convert_to_string_functions[field_name]
+        elif field_name == 'timestamp':
+            return datetime.datetime.isoformat
+        else:
+            return str
+
+    # Function used to convert non-empty strings of a field to values
+    def _from_string_function(self, field_name):
+        if field_name in self.convert_from_string_functions:
+            return self.convert_from_string_functions[field_name]
+        elif field_name == 'timestamp':
+            return _parse_timestamp
+        else:
+            return str
+
+    # Convert a single string/value for a field which may not be in the CSV
+    # file (rows are converted with the precomputed per-field functions)
     def _convert_from_string(self, field_name, string):
         if string is None or string == '':
             return None
-        elif field_name in self.convert_from_string_functions.keys():
-            return self.convert_from_string_functions[field_name](string)
-        elif field_name == 'timestamp':
-            return dateutil.parser.parse(string)
         else:
-            return string
+            return self._from_string_function(field_name)(string)
 
     def _convert_to_string(self, field_name, value):
         if value is None:
             return ''
-        elif field_name in self.convert_to_string_functions.keys():
-            return self.convert_to_string_functions[field_name](value)
-        elif field_name == 'timestamp':
-            return value.isoformat()
         else:
-            return str(value)
+            return self._to_string_function(field_name)(value)
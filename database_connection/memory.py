@@ -1,14 +1,31 @@
 from . import DatabaseConnection
+import bisect
+import operator
 
 class DatabaseConnectionMemory(DatabaseConnection):
     """
     Class to define a DatabaseConnection to a database in memory
+
+    Datapoints are kept in time order, so fetched data is returned in time
+    order.
     """
 
+    __slots__ = (
+        'data',
+        '_timestamps',
+        '_object_ids',
+        '_object_id_index'
+    )
+
+    _fetches_in_time_order = True
+
     def __init__(
         self,
         time_series_database = True,
-        object_database = True
+        object_database = True,
+        batch_size = 1000,
+        flush_interval = 1.0,
+        background_flush = False
     ):
         """
         Constructor for DatabaseConnectionMemory.
@@ -27,12 +44,27 @@ class DatabaseConnectionMemory(DatabaseConnection):
         Parameters:
             time_series_database (bool): Boolean indicating whether database is a time series database (default is True)
             object_database (bool): Boolean indicating whether database is an object database (default is True)
+            batch_size (int): Maximum number of buffered datapoints written in a single batch (default is 1000)
+            flush_interval (float): Maximum time in seconds between buffer flushes (default is 1.0)
+            background_flush (bool): Boolean indicating whether to flush the buffer from a background thread (default is False)
         """
-        if not time_series_database and not object_database:
-            raise ValueError('Database must be a time series database, an object database, or an object time series database')
-        self.time_series_database = time_series_database
-        self.object_database = object_database
+        super().__init__(
+            time_series_database = time_series_database,
+            object_database = object_database,
+            batch_size = batch_size,
+            flush_interval = flush_interval,
+            background_flush = background_flush
+        )
         self.data = []
+        # Timestamps and object IDs of the datapoints in self.data, stored as
+        # separate columns so that filters do not need to look into each datum.
+        # All three lists are kept sorted by timestamp.
+        self._timestamps = []
+        self._object_ids = []
+        # Positions of the datapoints for each object ID (in time order). Built
+        # on first use, kept up to date as datapoints are written, and
+        # discarded when datapoints are deleted.
+        self._object_id_index = None
 
     # Internal method for writing single datapoint of object time series data
     # (memory-database-specific)
@@ -47,7 +79,24 @@ class DatabaseConnectionMemory(DatabaseConnection):
             'object_id': object_id
         }
         datum.update(data)
-        self.data.append(datum)
+        if not self._timestamps or timestamp >= self._timestamps[-1]:
+            if self._object_id_index is not None:
+                self._object_id_index.setdefault(object_id, []).append(len(self.data))
+            self.data.append(datum)
+            self._timestamps.append(timestamp)
+            self._object_ids.append(object_id)
+        else:
+            # Only the datapoints after the insertion point are moved
+            i = bisect.bisect_right(self._timestamps, timestamp)
+            self.data.insert(i, datum)
+            self._timestamps.insert(i, timestamp)
+            self._object_ids.insert(i, object_id)
+            if self._object_id_index is not None:
+                for positions in self._object_id_index.values():
+                    j = bisect.bisect_left(positions, i)
+                    positions[j:] = [position + 1 for position in positions[j:]]
+                positions = self._object_id_index.setdefault(object_id, [])
+                positions.insert(bisect.bisect_left(positions, i), i)
 
     # Internal method for writing multiple datapoints of object time series data
     # (memory-database-specific)
@@ -55,7 +104,45 @@ class DatabaseConnectionMemory(DatabaseConnection):
         self,
         datapoints
     ):
+        if datapoints:
+            self._insert_datapoints(datapoints)
+
+    # Insert datapoints into the time-ordered columns, keeping the object ID
+    # index (if it has been built) up to date
+    def _insert_datapoints(self, datapoints):
+        timestamps = [datapoint['timestamp'] for datapoint in datapoints]
+        if not all(map(operator.le, timestamps, timestamps[1:])):
+            order = sorted(range(len(timestamps)), key = timestamps.__getitem__)
+            datapoints = [datapoints[i] for i in order]
+            timestamps = [timestamps[i] for i in order]
+        object_ids = [datapoint['object_id'] for datapoint in datapoints]
+        # Datapoints usually arrive in (roughly) time order, so only the
+        # existing datapoints after the earliest new one need to be merged with
+        # the new datapoints
+        i = bisect.bisect_right(self._timestamps, timestamps[0])
+        if i < len(self._timestamps):
+            merged_timestamps = self._timestamps[i:] + timestamps
+            # Both runs are already sorted, so this is a linear merge (existing
+            # datapoints come first when timestamps are equal)
+            order = sorted(range(len(merged_timestamps)), key = merged_timestamps.__getitem__)
+            merged_data = self.data[i:] + datapoints
+            merged_object_ids = self._object_ids[i:] + object_ids
+            datapoints = [merged_data[j] for j in order]
+            timestamps = [merged_timestamps[j] for j in order]
+            object_ids = [merged_object_ids[j] for j in order]
+            del self.data[i:]
+            del self._timestamps[i:]
+            del self._object_ids[i:]
+            if self._object_id_index is not None:
+                for positions in self._object_id_index.values():
+                    del positions[bisect.bisect_left(positions, i):]
         self.data.extend(datapoints)
+        self._timestamps.extend(timestamps)
+        self._object_ids.extend(object_ids)
+        if self._object_id_index is not None:
+            object_id_index = self._object_id_index
+            for position, object_id in enumerate(object_ids, i):
+                object_id_index.setdefault(object_id, []).append(position)
 
     # Internal method for fetching object time series data (memory-database-specific)
     def _fetch_data_object_time_series(
@@ -64,15 +151,23 @@ class DatabaseConnectionMemory(DatabaseConnection):
         end_time,
         object_ids
     ):
-        fetched_data = []
-        for datum in self.data:
-            if start_time is not None and datum['timestamp'] < start_time:
-                continue
-            if end_time is not None and datum['timestamp'] > end_time:
-                continue
-            if object_ids is not None and datum['object_id'] not in object_ids:
-                continue
-            fetched_data.append(datum)
+        start_index, end_index = self._time_range_indices(start_time, end_time)
+        if object_ids is None:
+            fetched_data = self.data[start_index:end_index]
+        else:
+            object_id_index = self._get_object_id_index()
+            object_ids = frozenset(object_ids)
+            positions = []
+            for object_id in object_ids:
+                object_id_positions = object_id_index.get(object_id)
+                if object_id_positions:
+                    positions.extend(object_id_positions[
+                        bisect.bisect_left(object_id_positions, start_index):
+                        bisect.bisect_left(object_id_positions, end_index)
+                    ])
+            if len(object_ids) > 1:
+                positions.sort()
+            fetched_data = [self.data[i] for i in positions]
         return fetched_data
 
     # Internal method for deleting object time series data (memory-database-specific)
@@ -82,11 +177,39 @@ class DatabaseConnectionMemory(DatabaseConnection):
         end_time,
         object_ids
     ):
-        for i in range(len(self.data) - 1, -1, -1):
-            if self.data[i]['timestamp'] < start_time:
-                continue
-            if self.data[i]['timestamp'] > end_time:
-                continue
-            if self.data[i]['object_id'] not in object_ids:
-                continue
-            del self.data[i]
+        object_ids = frozenset(object_ids)
+        start_index, end_index = self._time_range_indices(start_time, end_time)
+        kept_indices = [
+            i for i in range(start_index, end_index)
+            if self._object_ids[i] not in object_ids
+        ]
+        self.data[start_index:end_index] = [self.data[i] for i in kept_indices]
+        self._timestamps[start_index:end_index] = [self._timestamps[i] for i in kept_indices]
+        self._object_ids[start_index:end_index] = [self._object_ids[i] for i in kept_indices]
+        if len(kept_indices) < end_index - start_index:
+            self._object_id_index = None
+
+    def _get_object_id_index(self):
+        if self._object_id_index is None:
+            object_id_index = {}
+            for i, object_id in enumerate(self._object_ids):
+                object_id_index.setdefault(object_id, []).append(i)
+            self._object_id_index = object_id_index
+        return self._object_id_index
+
+    # Find the range of indices of datapoints within a timespan (inclusive of
+    # both ends) by binary search
+    def _time_range_indices(
+        self,
+        start_time,
+        end_time
+    ):
+        if start_time is None:
+            start_index = 0
+        else:
+            start_index = bisect.bisect_left(self._timestamps, start_time)
+        if end_time is None:
+            end_index = len(self._timestamps)
+        else:
+            end_index = bisect.bisect_right(self._timestamps, end_time)
+        return start_index, end_index
@@ -0,0 +1,148 @@
+import datetime
+import os
+import random
+import tempfile
+import threading
+import time
+import unittest
+
+from database_connection.csv import DatabaseConnectionCSV
+from database_connection.memory import DatabaseConnectionMemory
+
+START_TIME = datetime.datetime(2020, 1, 1, tzinfo = datetime.timezone.utc)
+
+# Buffer datapoints (with some clock skew between objects) from a separate
+# thread while the test reads or deletes data in the calling thread
+def produce(database_connection, num_datapoints, object_ids):
+    random_state = random.Random(0)
+    for i in range(num_datapoints):
+        timestamp = START_TIME + datetime.timedelta(seconds = i + random_state.uniform(-2.0, 2.0))
+        database_connection.buffer_datapoint_object_time_series(
+            timestamp,
+            object_ids[i % len(object_ids)],
+            {'value': str(i)}
+        )
+
+# Memory database which counts writes made while data is being fetched
+class DatabaseConnectionMemoryChecked(DatabaseConnectionMemory):
+
+    __slots__ = (
+        'fetching',
+        'num_overlapping_writes'
+    )
+
+    def _write_data_object_time_series(self, datapoints):
+        if self.fetching:
+            self.num_overlapping_writes += 1
+        super()._write_data_object_time_series(datapoints)
+
+    def _fetch_data_object_time_series(self, start_time, end_time, object_ids):
+        self.fetching = True
+        try:
+            time.sleep(0.001)
+            return super()._fetch_data_object_time_series(start_time, end_time, object_ids)
+        finally:
+            self.fetching = False
+
+class TestBackgroundFlush(unittest.TestCase):
+
+    def test_csv_delete_while_buffering(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database_connection = DatabaseConnectionCSV(
+                path = os.path.join(directory, 'test.csv'),
+                data_field_names = ['value'],
+                use_pandas = False,
+                batch_size = 10,
+                flush_interval = 0.001,
+                background_flush = True
+            )
+            producer = threading.Thread(
+                target = produce,
+                args = (database_connection, 3000, ['a', 'b'])
+            )
+            producer.start()
+            while producer.is_alive():
+                database_connection.delete_data_object_time_series(
+                    START_TIME - datetime.timedelta(days = 1),
+                    START_TIME + datetime.timedelta(days = 1),
+                    ['not_an_object_id']
+                )
+            producer.join()
+            database_connection.close()
+            data = database_connection.fetch_data_object_time_series()
+            self.assertEqual(
+                sorted(int(datapoint['value']) for datapoint in data),
+                list(range(3000))
+            )
+
+    def test_memory_fetch_while_buffering(self):
+        database_connection = DatabaseConnectionMemoryChecked(
+            batch_size = 10,
+            flush_interval = 0.001,
+            background_flush = True
+        )
+        database_connection.fetching = False
+        database_connection.num_overlapping_writes = 0
+        producer = threading.Thread(
+            target = produce,
+            args = (database_connection, 5000, ['a', 'b', 'c'])
+        )
+        producer.start()
+        start_time = START_TIME + datetime.timedelta(seconds = 100)
+        end_time = START_TIME + datetime.timedelta(seconds = 200)
+        while producer.is_alive():
+            data = database_connection.fetch_data_object_time_series(
+                start_time = start_time,
+                end_time = end_time,
+                object_ids = ['b']
+            )
+            for datapoint in data:
+                self.assertEqual(datapoint['object_id'], 'b')
+                self.assertTrue(start_time <= datapoint['timestamp'] <= end_time)
+            timestamps = [datapoint['timestamp'] for datapoint in data]
+            self.assertEqual(timestamps, sorted(timestamps))
+        producer.join()
+        database_connection.close()
+        self.assertEqual(database_connection.num_overlapping_writes, 0)
+        self.assertEqual(len(database_connection.fetch_data_object_time_series()), 5000)
+
+    def test_background_write_error_is_reported(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database_connection = DatabaseConnectionCSV(
+                path = os.path.join(directory, 'test.csv'),
+                data_field_names = ['value'],
+                convert_to_string_functions = {'value': lambda value: '%d' % value},
+                use_pandas = False,
+                flush_interval = 0.001,
+                background_flush = True
+            )
+            database_connection.buffer_datapoint_object_time_series(START_TIME, 'a', {'value': 'not_a_number'})
+            time.sleep(0.1)
+            database_connection.buffer_datapoint_object_time_series(START_TIME, 'a', {'value': 1})
+            with self.assertRaises(TypeError):
+                database_connection.fetch_data_object_time_series()
+            data = database_connection.fetch_data_object_time_series()
+            self.assertEqual([datapoint['value'] for datapoint in data], ['1'])
+            database_connection.close()
+
+    def test_invalid_flush_interval(self):
+        for flush_interval in [0, -1.0]:
+            with self.assertRaises(ValueError):
+                DatabaseConnectionMemory(
+                    flush_interval = flush_interval,
+                    background_flush = True
+                )
+
+    def test_failed_construction_does_not_start_thread(self):
+        num_threads = threading.active_count()
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                DatabaseConnectionCSV(
+                    path = os.path.join(tempfile.gettempdir(), 'unused.csv'),
+                    data_field_names = ['timestamp'],
+                    background_flush = True
+                )
+        self.assertEqual(threading.active_count(), num_threads)
+
+if __name__ == '__main__':
+    unittest.main()
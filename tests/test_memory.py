@@ -0,0 +1,109 @@
+import datetime
+import random
+import unittest
+
+from database_connection.memory import DatabaseConnectionMemory
+
+START_TIME = datetime.datetime(2020, 1, 1, tzinfo = datetime.timezone.utc)
+OBJECT_IDS = ['a', 'b', 'c', 'd']
+
+def random_timestamp(random_state):
+    return START_TIME + datetime.timedelta(seconds = random_state.randint(0, 100))
+
+def random_time_range(random_state):
+    start_time, end_time = sorted([random_timestamp(random_state), random_timestamp(random_state)])
+    return start_time, end_time
+
+class TestDatabaseConnectionMemory(unittest.TestCase):
+
+    # Compare fetches from the memory database against a plain list of the
+    # datapoints written, after random sequences of writes and deletes
+    def test_fetch_matches_reference(self):
+        for seed in range(50):
+            random_state = random.Random(seed)
+            database_connection = DatabaseConnectionMemory(batch_size = 5)
+            reference = []
+            num_datapoints = 0
+            for _ in range(100):
+                operation = random_state.choice([
+                    'write_in_order',
+                    'write_out_of_order',
+                    'write_batch',
+                    'write_many',
+                    'buffer',
+                    'delete',
+                    'fetch'
+                ])
+                if operation in ['write_in_order', 'write_out_of_order', 'write_batch', 'write_many', 'buffer']:
+                    if operation == 'write_in_order':
+                        latest_timestamp = max([datapoint['timestamp'] for datapoint in reference], default = START_TIME)
+                        timestamps = [latest_timestamp + datetime.timedelta(seconds = random_state.randint(0, 2))]
+                    elif operation == 'write_out_of_order':
+                        timestamps = [random_timestamp(random_state)]
+                    else:
+                        timestamps = [random_timestamp(random_state) for _ in range(random_state.randint(0, 8))]
+                    datapoints = []
+                    for timestamp in timestamps:
+                        num_datapoints += 1
+                        datapoints.append({
+                            'timestamp': timestamp,
+                            'object_id': random_state.choice(OBJECT_IDS),
+                            'value': num_datapoints
+                        })
+                    reference.extend(dict(datapoint) for datapoint in datapoints)
+                    if operation == 'write_batch':
+                        database_connection.write_data_object_time_series(datapoints)
+                    elif operation == 'write_many':
+                        database_connection.write_data_object_time_series_many([
+                            (datapoint['timestamp'], datapoint['object_id'], {'value': datapoint['value']})
+                            for datapoint in datapoints
+                        ])
+                    elif operation == 'buffer':
+                        database_connection.buffer_data_object_time_series(datapoints)
+                    else:
+                        for datapoint in datapoints:
+                            database_connection.write_datapoint_object_time_series(
+                                datapoint['timestamp'],
+                                datapoint['object_id'],
+                                {'value': datapoint['value']}
+                            )
+                elif operation == 'delete':
+                    start_time, end_time = random_time_range(random_state)
+                    object_ids = random_state.sample(OBJECT_IDS, random_state.randint(1, len(OBJECT_IDS)))
+                    database_connection.delete_data_object_time_series(start_time, end_time, object_ids)
+                    reference = [
+                        datapoint for datapoint in reference
+                        if not (start_time <= datapoint['timestamp'] <= end_time and datapoint['object_id'] in object_ids)
+                    ]
+                else:
+                    start_time, end_time = random_time_range(random_state)
+                    object_ids = random_state.choice([
+                        None,
+                        random_state.sample(OBJECT_IDS, random_state.randint(1, len(OBJECT_IDS)))
+                    ])
+                    self.check_fetch(database_connection, reference, start_time, end_time, object_ids)
+            self.check_fetch(database_connection, reference, None, None, None)
+
+    def check_fetch(self, database_connection, reference, start_time, end_time, object_ids):
+        expected_values = sorted(
+            datapoint['value'] for datapoint in reference
+            if (start_time is None or datapoint['timestamp'] >= start_time) and
+            (end_time is None or datapoint['timestamp'] <= end_time) and
+            (object_ids is None or datapoint['object_id'] in object_ids)
+        )
+        bucket_sizes = [None]
+        if start_time is not None and end_time is not None:
+            bucket_sizes.append(datetime.timedelta(seconds = 7))
+        for bucket_size in bucket_sizes:
+            data = database_connection.fetch_data_object_time_series(
+                start_time = start_time,
+                end_time = end_time,
+                object_ids = object_ids,
+                bucket_size = bucket_size
+            )
+            self.assertEqual(sorted(datapoint['value'] for datapoint in data), expected_values)
+            timestamps = [datapoint['timestamp'] for datapoint in data]
+            self.assertEqual(timestamps, sorted(timestamps))
+
+if __name__ == '__main__':
+    unittest.main()
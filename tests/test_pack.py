@@ -0,0 +1,73 @@
+import datetime
+import unittest
+
+import database_connection
+from database_connection import pack_datapoints, unpack_datapoints
+
+START_TIME = datetime.datetime(2020, 1, 1, tzinfo = datetime.timezone.utc)
+
+class TestPackDatapoints(unittest.TestCase):
+
+    def test_round_trip(self):
+        datapoints = [
+            {
+                'timestamp': START_TIME + datetime.timedelta(seconds = i),
+                'object_id': 'a',
+                'value': i
+            }
+            for i in range(100)
+        ]
+        blobs = list(pack_datapoints(datapoints, target_bytes = 500))
+        self.assertGreater(len(blobs), 1)
+        unpacked_datapoints = []
+        for earliest_timestamp, latest_timestamp, num_datapoints, blob in blobs:
+            self.assertLessEqual(len(blob), 500)
+            blob_datapoints = list(unpack_datapoints(blob))
+            self.assertEqual(len(blob_datapoints), num_datapoints)
+            self.assertEqual(earliest_timestamp, min(datapoint['timestamp'] for datapoint in blob_datapoints))
+            self.assertEqual(latest_timestamp, max(datapoint['timestamp'] for datapoint in blob_datapoints))
+            unpacked_datapoints.extend(blob_datapoints)
+        self.assertEqual(unpacked_datapoints, datapoints)
+
+    def test_datapoint_larger_than_target_bytes(self):
+        datapoints = [
+            {'timestamp': START_TIME, 'object_id': 'a', 'value': 'small'},
+            {'timestamp': START_TIME, 'object_id': 'b', 'value': 'x' * 1000},
+            {'timestamp': START_TIME, 'object_id': 'c', 'value': 'small'}
+        ]
+        blobs = list(pack_datapoints(datapoints, target_bytes = 100))
+        self.assertEqual([num_datapoints for _, _, num_datapoints, _ in blobs], [1, 1, 1])
+        self.assertGreater(len(blobs[1][3]), 1000)
+        unpacked_datapoints = [datapoint for _, _, _, blob in blobs for datapoint in unpack_datapoints(blob)]
+        self.assertEqual(unpacked_datapoints, datapoints)
+
+    def test_empty(self):
+        self.assertEqual(list(pack_datapoints([])), [])
+        self.assertEqual(list(unpack_datapoints(b'')), [])
+
+    def test_timestamp_encoding(self):
+        if database_connection.ORJSON_INSTALLED:
+            timestamp_string = b'"2020-01-01T00:00:00Z"'
+        else:
+            timestamp_string = b'"2020-01-01T00:00:00+00:00"'
+        # Timezone-naive timestamps are assumed to be UTC
+        for timestamp in [START_TIME, START_TIME.replace(tzinfo = None)]:
+            (_, _, _, blob), = pack_datapoints([{'timestamp': timestamp, 'object_id': 'a'}])
+            self.assertIn(timestamp_string, blob)
+            self.assertEqual(
+                list(unpack_datapoints(blob)),
+                [{'timestamp': START_TIME, 'object_id': 'a'}]
+            )
+
+    def test_unpack_either_timestamp_encoding(self):
+        blob = b''
+        for timestamp_string in [b'2020-01-01T00:00:00Z', b'2020-01-01T00:00:00+00:00']:
+            payload = b'{"timestamp": "' + timestamp_string + b'", "object_id": "a"}'
+            blob += len(payload).to_bytes(4, 'big') + payload
+        self.assertEqual(
+            list(unpack_datapoints(blob)),
+            [{'timestamp': START_TIME, 'object_id': 'a'}] * 2
+        )
+
+if __name__ == '__main__':
+    unittest.main()